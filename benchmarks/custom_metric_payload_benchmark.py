@@ -0,0 +1,95 @@
+"""
+Compares time spent per send cycle on building and logging the custom metric payload
+with the previous path (json.dumps, full payload and request URL printed on every
+attempt, uncompressed body) and the current path (compact encoder, body gzip compressed
+above GZIP_MIN_SIZE_IN_BYTES, payload logged only when IS_VERBOSE=True).
+
+Logs are written to a temporary file and flushed on every cycle like unbuffered stdout
+in a container, so the cost of printing the full payload is included.
+
+Run from the project directory:
+    python3 benchmarks/custom_metric_payload_benchmark.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+import timeit
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from custom_metric_payload import (  # noqa: E402
+    encode_custom_metric_body,
+    serialize_custom_metric,
+)
+
+SERIES_COUNTS = [10, 100, 1000]
+ROUNDS = 200
+REQUEST_URL = "https://westeurope.monitoring.azure.com/subscriptions/00000000-0000-0000-0000-000000000000/resourceGroups/resource-group/providers/Microsoft.Compute/virtualMachines/vm/metrics"
+
+
+def get_custom_metric_object(series_count):
+    series_array = [
+        {
+            "dimValues": [
+                f"10.0.0.{index % 255}:/hfp/v2/journey/ongoing/vp/bus/{index}/*:1883"
+            ],
+            "sum": round(index * 1.37, 2),
+            "count": 1,
+        }
+        for index in range(series_count)
+    ]
+    return {
+        "time": "2024-01-01T00:00:00",
+        "data": {
+            "baseData": {
+                "metric": "Msg Count",
+                "namespace": "MQTT",
+                "dimNames": ["Topic"],
+                "series": series_array,
+            }
+        },
+    }
+
+
+def previous_cycle(custom_metric_object, log_file):
+    custom_metric_json = json.dumps(custom_metric_object)
+    with redirect_stdout(log_file):
+        print("-------------------")
+        print(f"Request URL: {REQUEST_URL}.")
+        print(f"Custom metric JSON: {custom_metric_json}.")
+        print("RETURNING TRUE")
+    log_file.flush()
+    return custom_metric_json.encode("utf-8")
+
+
+def current_cycle(custom_metric_object, log_file):
+    custom_metric_json = serialize_custom_metric(custom_metric_object)
+    (body, _) = encode_custom_metric_body(custom_metric_json)
+    return body
+
+
+def main():
+    print(
+        f"{'series':>8} {'previous ms':>12} {'current ms':>12} {'previous bytes':>15} {'current bytes':>14}"
+    )
+    with tempfile.TemporaryFile("w") as log_file:
+        for series_count in SERIES_COUNTS:
+            custom_metric_object = get_custom_metric_object(series_count)
+            results = []
+            for cycle in (previous_cycle, current_cycle):
+                seconds = timeit.timeit(
+                    lambda: cycle(custom_metric_object, log_file), number=ROUNDS
+                )
+                payload = cycle(custom_metric_object, log_file)
+                results.append((seconds / ROUNDS * 1000, len(payload)))
+            ((previous_ms, previous_bytes), (current_ms, current_bytes)) = results
+            print(
+                f"{series_count:>8} {previous_ms:>12.3f} {current_ms:>12.3f} {previous_bytes:>15} {current_bytes:>14}"
+            )
+
+
+if __name__ == "__main__":
+    main()
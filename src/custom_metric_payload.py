@@ -0,0 +1,34 @@
+import gzip
+import json
+
+# Custom metric objects are plain dicts and lists, so the circular reference check can be skipped.
+# Compact separators keep the payload small, serializing is not faster than json.dumps.
+CUSTOM_METRIC_JSON_ENCODER = json.JSONEncoder(
+    separators=(",", ":"), check_circular=False
+)
+
+# Series payloads are very repetitive, already the fastest level compresses them roughly 10x
+GZIP_COMPRESS_LEVEL = 1
+
+# Smaller payloads, e.g. single series from Pulsar and GTFS-RT collectors, are sent uncompressed
+# since compressing them costs more than it saves
+GZIP_MIN_SIZE_IN_BYTES = 1024
+
+
+def serialize_custom_metric(custom_metric_object):
+    """
+    Serializes custom metric object into a compact JSON string.
+    """
+    return CUSTOM_METRIC_JSON_ENCODER.encode(custom_metric_object)
+
+
+def encode_custom_metric_body(custom_metric_json):
+    """
+    Encodes custom metric JSON string into request body.
+    Returns tuple (body, content_encoding) where content_encoding is "gzip" if the body
+    was compressed and None otherwise.
+    """
+    body = custom_metric_json.encode("utf-8")
+    if len(body) < GZIP_MIN_SIZE_IN_BYTES:
+        return (body, None)
+    return (gzip.compress(body, compresslevel=GZIP_COMPRESS_LEVEL, mtime=0), "gzip")
@@ -1,4 +1,3 @@
-import json
 import os
 import time
 from datetime import datetime
@@ -7,6 +6,7 @@ import requests
 from dotenv import load_dotenv
 from google.transit import gtfs_realtime_pb2
 
+from custom_metric_payload import serialize_custom_metric
 from send_data_to_azure_monitor import send_custom_metrics_request
 
 load_dotenv()
@@ -45,7 +45,7 @@ def send_data_to_azure_monitor(time, metric, url, value):
         },
     }
 
-    custom_metric_json = json.dumps(custom_metric_object)
+    custom_metric_json = serialize_custom_metric(custom_metric_object)
 
     if IS_DEBUG:
         print(custom_metric_json)
@@ -1,4 +1,5 @@
-import json
+import bisect
+import hashlib
 import os
 import time
 from datetime import datetime
@@ -7,6 +8,7 @@ from threading import Thread
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 
+from custom_metric_payload import serialize_custom_metric
 from send_data_to_azure_monitor import send_custom_metrics_request
 
 load_dotenv()
@@ -20,11 +22,31 @@ IS_DEBUG = os.getenv("IS_DEBUG") == "True"
 # How long to listen to the topics until we send data to Azure. Should be 60 in production
 MONITOR_PERIOD_IN_SECONDS = 60 if not IS_DEBUG else 20
 
+# Optional path to a file listing the topics to monitor, one <IP address>,<topic name>,<port> per line.
+# The file is checked for changes every monitor period so that topics can be added or removed without a restart.
+# If not set, topics are read from TOPIC<topic index> env variables.
+TOPICS_CONFIG_PATH = os.getenv("TOPICS_CONFIG_PATH")
+
+# Optional sharding of topics across replicas. Each replica is given the same SHARD_COUNT and
+# its own SHARD_INDEX (0..SHARD_COUNT-1) and monitors only the topics that hash into its shard.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+IS_SHARDED = SHARD_COUNT > 1
+
+# Number of points each shard has on the hash ring, more points spread the topics more evenly
+SHARD_VIRTUAL_NODES = 100
+
+if SHARD_COUNT < 1 or not 0 <= SHARD_INDEX < SHARD_COUNT:
+    raise Exception(
+        f"Invalid shard config, SHARD_INDEX must be between 0 and SHARD_COUNT - 1. SHARD_COUNT: {SHARD_COUNT}, SHARD_INDEX: {SHARD_INDEX}"
+    )
+
 
 class Topic:
     is_starting = False  # True while connecting to the broker, False when connected or disconnected
     is_running = False
     msg_count = 0
+    client = None
 
     measuring_started_at = None
     measuring_stopped_at = None
@@ -56,6 +78,7 @@ class Topic:
         self.measuring_stopped_at = None
 
         client = mqtt.Client()
+        self.client = client
 
         client.on_connect = self._on_connect_callback
         client.on_message = self._on_message_callback
@@ -64,13 +87,33 @@ class Topic:
         # Enable debugging if needed
         # client.on_log = self._on_log_callback
 
-        client.connect_async(
-            self.topic_address, int(self.topic_port), MQTT_KEEP_ALIVE_SECS
-        )
+        try:
+            client.connect_async(
+                self.topic_address, int(self.topic_port), MQTT_KEEP_ALIVE_SECS
+            )
 
-        print(f"Connecting to MQTT broker at {self.get_broker_address()}")
-        # Starts thread that processes network traffic and dispatches callbacks
-        client.loop_start()
+            print(f"Connecting to MQTT broker at {self.get_broker_address()}")
+            # Starts thread that processes network traffic and dispatches callbacks
+            client.loop_start()
+        except Exception:
+            # Allow starting again on the next round instead of staying in is_starting state
+            self.is_starting = False
+            raise
+
+    def stop_listening(self):
+        """
+        Disconnects from the broker and stops the network loop. Used when the topic is
+        removed from the config.
+        """
+        if self.client is None:
+            return
+        print(
+            f"Stopping MQTT client for {self.get_broker_address()} on topic {self.topic_name}"
+        )
+        self.client.disconnect()
+        self.client.loop_stop()
+        self.is_starting = False
+        self.is_running = False
 
     # The callback for when the client receives a CONNACK response from the server.
     def _on_connect_callback(self, client, userdata, flags, rc):
@@ -138,40 +181,175 @@ class Topic:
     # print(buf)
 
 
-def main():
+def parse_topic_data_string(topic_data_string):
     """
-    Listens each topic continuously in a thread. Sends topic messages count per second every
-    minute to Azure Monitor.
-
-    In order for this to work, info for each topic (IP address, topic name and port) has to
-    be defined in .env file with format: TOPIC<topic index>=<IP address, topic name, port>
+    Parses topic data string with format <IP address>,<topic name>,<port>
+    Returns tuple (topic_address, topic_name, topic_port)
     """
-    print("Starting MQTT topic listener...")
+    if topic_data_string is None or topic_data_string.count(",") != 2:
+        raise Exception(
+            f"Some topic data was missing. Required data: address,topic,port. We got: {topic_data_string}"
+        )
+    topic_data_array = topic_data_string.split(",")
+    topic_address = topic_data_array[0].strip()
+    topic_name = topic_data_array[1].strip()
+    topic_port = topic_data_array[2].strip()
+    if not topic_address or not topic_name or not topic_port:
+        raise Exception(
+            f"Some required topic data was missing, topic_address: {topic_address}, topic_name: {topic_name}, topic_port: {topic_port}"
+        )
+    if not topic_port.isdigit() or not 1 <= int(topic_port) <= 65535:
+        raise Exception(
+            f"Topic port must be a number between 1 and 65535, topic_name: {topic_name}, topic_port: {topic_port}"
+        )
+    return (topic_address, topic_name, topic_port)
 
-    topic_list = []
+
+def get_topic_key(topic_data):
+    (topic_address, topic_name, topic_port) = topic_data
+    return f"{topic_address}:{topic_name}:{topic_port}"
+
+
+def read_topics_from_env():
+    """
+    Reads topics from env variables with format: TOPIC<topic index>=<IP address, topic name, port>
+    Returns map of topic key -> (topic_address, topic_name, topic_port)
+    """
+    topic_data_map = {}
     index = 1
     while True:
         topic_data_string = os.getenv(f"TOPIC{index}")
         index += 1
         if topic_data_string is None:
             break
-        if topic_data_string is None or topic_data_string.count(",") != 2:
-            raise Exception(
-                f"Some topic data was missing. Required data: address,topic,port. We got: {topic_data_string}"
-            )
-        topic_data_array = topic_data_string.split(",")
-        topic_address = topic_data_array[0]
-        topic_name = topic_data_array[1]
-        topic_port = topic_data_array[2]
-        if topic_address is None or topic_name is None or topic_port is None:
-            raise Exception(
-                f"Some required topic data was missing, topic_address: {topic_address}, topic_name: {topic_name}, topic_port: {topic_port}"
-            )
+        topic_data = parse_topic_data_string(topic_data_string)
+        topic_data_map[get_topic_key(topic_data)] = topic_data
+    return topic_data_map
+
+
+def read_topics_from_file(path):
+    """
+    Reads topics from a file that has one topic per line with format: <IP address>,<topic name>,<port>
+    Empty lines and lines starting with # are ignored.
+    Returns map of topic key -> (topic_address, topic_name, topic_port)
+    """
+    topic_data_map = {}
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            topic_data = parse_topic_data_string(line)
+            topic_data_map[get_topic_key(topic_data)] = topic_data
+    return topic_data_map
+
+
+def get_topics_config_mtime():
+    try:
+        return os.stat(TOPICS_CONFIG_PATH).st_mtime_ns
+    except OSError as e:
+        print(f"Could not read topics config file {TOPICS_CONFIG_PATH}: {e}")
+        return None
+
+
+def get_hash(key):
+    # Python's hash() is randomized per process, md5 gives the same result on every replica
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+def build_shard_ring(shard_count):
+    """
+    Builds a consistent hashing ring with SHARD_VIRTUAL_NODES points for each shard.
+    Returns a tuple of sorted point hashes and the shard index of each point.
+    """
+    ring = sorted(
+        (get_hash(f"shard-{shard_index}-{virtual_node}"), shard_index)
+        for shard_index in range(shard_count)
+        for virtual_node in range(SHARD_VIRTUAL_NODES)
+    )
+    return ([point for point, _ in ring], [shard_index for _, shard_index in ring])
+
+
+SHARD_RING = build_shard_ring(SHARD_COUNT)
+
+
+def get_shard_index(topic_key, shard_ring=SHARD_RING):
+    """
+    Returns the shard that owns topic_key, which is the shard of the first point on
+    the ring after the hash of the topic_key.
+    """
+    (ring_points, ring_shards) = shard_ring
+    index = bisect.bisect(ring_points, get_hash(topic_key)) % len(ring_points)
+    return ring_shards[index]
+
+
+def filter_topics_for_shard(topic_data_map):
+    """
+    Returns only the topics that belong to this replica's shard.
+    """
+    if not IS_SHARDED:
+        return topic_data_map
+    return {
+        topic_key: topic_data
+        for topic_key, topic_data in topic_data_map.items()
+        if get_shard_index(topic_key) == SHARD_INDEX
+    }
+
+
+def update_topics(topic_map, topic_data_map):
+    """
+    Starts topics that are in topic_data_map but not in topic_map and stops topics
+    that are in topic_map but not in topic_data_map. Topics that exist in both
+    are left untouched so that their message counters are kept.
+    Topics that fail to start are logged and left out of topic_map, so that they
+    don't prevent other topics from starting.
+    """
+    removed_topic_keys = topic_map.keys() - topic_data_map.keys()
+    added_topic_keys = topic_data_map.keys() - topic_map.keys()
+
+    for topic_key in removed_topic_keys:
+        print(f"Topic {topic_key} was removed from config, stopping it.")
+        topic_map.pop(topic_key).stop_listening()
+
+    for topic_key in added_topic_keys:
+        print(f"Topic {topic_key} was added to config, starting it.")
+        (topic_address, topic_name, topic_port) = topic_data_map[topic_key]
         topic = Topic(topic_address, topic_name, topic_port)
-        topic_list.append(topic)
+        try:
+            topic.listen_topic()
+        except Exception as e:
+            print(f"Failed to start topic {topic_key}, skipping it: {e}")
+            continue
+        topic_map[topic_key] = topic
+
+
+def main():
+    """
+    Listens each topic continuously in a thread. Sends topic messages count per second every
+    minute to Azure Monitor.
 
-    for topic in topic_list:
-        topic.listen_topic()
+    In order for this to work, info for each topic (IP address, topic name and port) has to
+    be defined in .env file with format: TOPIC<topic index>=<IP address, topic name, port>
+    or in a file given with TOPICS_CONFIG_PATH env variable. The file is reloaded when it changes.
+    """
+    print("Starting MQTT topic listener...")
+    if IS_SHARDED:
+        print(f"Monitoring shard {SHARD_INDEX} of {SHARD_COUNT} shards")
+
+    # Structure:
+    # key: topic_key: <string> (<IP address>:<topic name>:<port>)
+    # value: topic: <Topic>
+    topic_map = {}
+
+    topics_config_mtime = None
+    if TOPICS_CONFIG_PATH is not None:
+        topics_config_mtime = get_topics_config_mtime()
+        update_topics(
+            topic_map,
+            filter_topics_for_shard(read_topics_from_file(TOPICS_CONFIG_PATH)),
+        )
+    else:
+        update_topics(topic_map, filter_topics_for_shard(read_topics_from_env()))
 
     time_end = time.perf_counter() + MONITOR_PERIOD_IN_SECONDS
     # Keep listening to topics forever
@@ -192,10 +370,7 @@ def main():
         topic_data_map = {}
 
         # Save message counters into topic_data_map and reset them in each topic
-        for topic in topic_list:
-            topic_data_map_key = (
-                f"{topic.topic_address}:{topic.topic_name}:{topic.topic_port}"
-            )
+        for topic_data_map_key, topic in topic_map.items():
             topic_data_map_value = topic.get_msg_count()
             if topic_data_map_value is not None:
                 topic_data_map[topic_data_map_key] = topic_data_map_value
@@ -207,8 +382,37 @@ def main():
         t = Thread(target=send_mqtt_msg_count_to_azure, args=(topic_data_map,))
         t.start()
 
+        # Reload topics if the config file has changed. Only the modification time is checked
+        # on each round, the file is parsed only when it has changed.
+        if TOPICS_CONFIG_PATH is not None:
+            new_topics_config_mtime = get_topics_config_mtime()
+            if (
+                new_topics_config_mtime is not None
+                and new_topics_config_mtime != topics_config_mtime
+            ):
+                print(f"Topics config file {TOPICS_CONFIG_PATH} changed, reloading it.")
+                # If the config can't be read, it is read again on the next round without
+                # advancing topics_config_mtime, e.g. when the file was read while being rewritten
+                try:
+                    new_topic_data_map = read_topics_from_file(TOPICS_CONFIG_PATH)
+                except Exception as e:
+                    new_topic_data_map = None
+                    print(f"Failed to reload topics config, no changes applied: {e}")
+
+                if new_topic_data_map is not None and not new_topic_data_map:
+                    # An empty file is more likely a partially written or truncated file than
+                    # a real config, stopping all topics would reset all counters
+                    print(
+                        "Topics config file has no topics, no changes applied. Keeping current topics."
+                    )
+                elif new_topic_data_map is not None:
+                    update_topics(
+                        topic_map, filter_topics_for_shard(new_topic_data_map)
+                    )
+                    topics_config_mtime = new_topics_config_mtime
+
         # (Re)start threads that are in is_running == False state
-        for topic in topic_list:
+        for topic in topic_map.values():
             if not topic.is_running:
                 print(f"Topic {topic.topic_name} was not running, starting it.")
 
@@ -242,15 +446,15 @@ def send_mqtt_msg_count_to_azure(topic_data_map):
                 "metric": "Msg Count",
                 # Namespace: Categorize or group similar metrics together
                 "namespace": "MQTT",
-                # Dimension (dimNames): Metric has a single dimension
-                "dimNames": ["Topic"],
+                # Dimension (dimNames): Metric has Topic dimension and Shard dimension when sharded
+                "dimNames": ["Topic", "Shard"] if IS_SHARDED else ["Topic"],
                 # Series: data for each monitored topic
                 "series": series_array,
             }
         },
     }
 
-    custom_metric_json = json.dumps(custom_metric_object)
+    custom_metric_json = serialize_custom_metric(custom_metric_object)
 
     if IS_DEBUG:
         print(custom_metric_json)
@@ -301,7 +505,8 @@ def get_series_array(topic_data_map):
         # Azure doesn't seem to like + in a dimValue, replace it with ^
         parsed_key = parsed_key.replace("+", "^")
 
-        dimValue = {"dimValues": [parsed_key], "sum": topic_msg_count, "count": 1}
+        dimValues = [parsed_key, str(SHARD_INDEX)] if IS_SHARDED else [parsed_key]
+        dimValue = {"dimValues": dimValues, "sum": topic_msg_count, "count": 1}
         series_array.append(dimValue)
     return series_array
 
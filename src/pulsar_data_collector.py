@@ -1,10 +1,10 @@
-import json
 import os
 from datetime import datetime
 
 import requests
 from dotenv import load_dotenv
 
+from custom_metric_payload import serialize_custom_metric
 from send_data_to_azure_monitor import send_custom_metrics_request
 
 load_dotenv()
@@ -156,7 +156,7 @@ def send_pulsar_topic_metric_into_azure(log_analytics_metric_name, series_array)
         },
     }
 
-    custom_metric_json = json.dumps(custom_metric_object)
+    custom_metric_json = serialize_custom_metric(custom_metric_object)
 
     if IS_DEBUG:
         print(custom_metric_json)
@@ -4,8 +4,13 @@ import os
 import requests
 from dotenv import load_dotenv
 
+from custom_metric_payload import encode_custom_metric_body
+
 load_dotenv()
 
+# Log full custom metric JSON of every request
+IS_VERBOSE = os.getenv("IS_VERBOSE") == "True"
+
 ### SECRETS / ENV VARIABLES ###
 
 TENANT_ID = os.getenv("TENANT_ID")
@@ -30,6 +35,21 @@ def send_custom_metrics_request(custom_metric_json, attempts_remaining):
     Sends custom metrics request to Azure. Tries to send as many times as given attempts_remaining.
     When sending is successful, returns True, otherwise returns False
     """
+    if IS_VERBOSE:
+        print(f"Custom metric JSON: {custom_metric_json}.")
+
+    # Encode only once, the same body is used for all attempts
+    (body, content_encoding) = encode_custom_metric_body(custom_metric_json)
+    return send_encoded_custom_metrics_request(
+        body, content_encoding, attempts_remaining
+    )
+
+
+def send_encoded_custom_metrics_request(body, content_encoding, attempts_remaining):
+    """
+    Sends encoded custom metrics request body to Azure. Tries to send as many times as given attempts_remaining.
+    When sending is successful, returns True, otherwise returns False
+    """
 
     # Exit if number of attempts reaches zero.
     if attempts_remaining == 0:
@@ -49,19 +69,18 @@ def send_custom_metrics_request(custom_metric_json, attempts_remaining):
         "Content-type": "application/json",
         "Authorization": f"Bearer {existing_access_token}",
     }
-    response = requests.post(
-        request_url, data=custom_metric_json, headers=headers, timeout=60
-    )
-
-    print("-------------------")
-    print(f"Request URL: {request_url}.")
-    print(f"Custom metric JSON: {custom_metric_json}.")
+    if content_encoding is not None:
+        headers["Content-Encoding"] = content_encoding
+    response = requests.post(request_url, data=body, headers=headers, timeout=60)
 
     # Return if response is successful
     if response.status_code == 200:
-        print("RETURNING TRUE")
         return True
 
+    print("-------------------")
+    print(f"Request URL: {request_url}.")
+    print(f"Response status code: {response.status_code}.")
+
     # Try catch because json.loads(response.text) might not be available
     try:
         response_dict = json.loads(response.text)
@@ -70,13 +89,17 @@ def send_custom_metrics_request(custom_metric_json, attempts_remaining):
                 "Currently stored access token has expired, getting a new access token."
             )
             request_new_access_token_and_write_it_on_disk()
-            return send_custom_metrics_request(custom_metric_json, attempts_remaining)
+            return send_encoded_custom_metrics_request(
+                body, content_encoding, attempts_remaining
+            )
         elif response_dict["Error"]["Code"] == "InvalidToken":
             print(
                 "Currently stored access token is invalid, getting a new access token."
             )
             request_new_access_token_and_write_it_on_disk()
-            return send_custom_metrics_request(custom_metric_json, attempts_remaining)
+            return send_encoded_custom_metrics_request(
+                body, content_encoding, attempts_remaining
+            )
         else:
             print(f"Request failed for an unknown reason, response: {response_dict}.")
     except Exception: